@@ -1,15 +1,16 @@
 # -*- coding: utf-8 -*-
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """
 PCAS driver for software syncing the Nikon DS-Qi2 Detector with Oxford & SRI X-ray sources.
 Adapted from varianSync.py. Requires sscan and scanProgress IOC's to be running.
 
 __author__   =   Alireza Panna
 __status__   =   Stable
-__version__  =   1-3
+__version__  =   1-4
 __to-do__    =   Need to test usb-6501 to see how fast we can poll camera output lines and how long to wait after
-                 sending trigger inputs to the camera. Currently after sending trigger we wait 25ms. Since the camera acquisition
-                 starts at rising transition (0->1)  We effectively wait 50ms between exposures. 
+                 sending trigger inputs to the camera. Currently the trigger line is held low for 25ms before each trigger,
+                 after sending the trigger we continue as soon as the camera reports it is exposing. Since the camera
+                 acquisition starts at rising transition (0->1) this adds 25ms between exposures. 
 __date__     =   4/1/2016
 """
 """
@@ -39,19 +40,43 @@ CHANGELOG:
                       updated, exception added if dutycycle list is empty after scan, scan abort sequence now runs in a seperate
                       thread rather than from the callback function itself, implemented soft sync (rename hardSync() to sync()
                       as a fallback incase DAQ is disconnected or not working. Update version to 1-3.
+10/15/2026            Port to python 3 (print function, f-strings, time.perf_counter for acquisition timing,
+                      psutil nice() api). Qi2 inputs use DAQ change detection where supported, sync waits on
+                      Qi2 edge events (with timeouts, cancelled by scan abort) instead of polling, console
+                      output goes through logging ($(P)DEBUG enables per-exposure messages).
+                      Update version to 1-4.
 """
 from pcaspy import SimpleServer, Driver
 from epics import *
 from PyDAQmx import *
 import os, sys, datetime, psutil, time
 import threading
+import collections
+import queue
 import numpy as np
 import matplotlib.pyplot as plt
 import inspect
+import logging
 
 sys.path.append(os.path.realpath('../utils'))
 import epicsApps
 
+# The process exits with os._exit, skip registering pyepics' CA context cleanup at exit.
+# Must be set before the first PV below initializes libca.
+ca.AUTO_CLEANUP = False
+
+log = logging.getLogger('nikonKsSync')
+# per-exposure timing messages are logged at DEBUG, enable with $(P):DEBUG
+log.setLevel(logging.INFO)
+
+class NumericPV(PV):
+    """
+    PV for monitored numeric channels that are never read with as_string=True. Skips the
+    char_value formatting pyepics otherwise does on every monitor update.
+    """
+    def _set_charval(self, val, call_ca = True, **kw):
+        return val
+
 EXPERIMENT = 'HPFI:'
 DAQ_NAME                      = 'cpiSync'
 NIKON_EXPOSE                  = DAQ_NAME + '/port2/line0' # Output from DAQ to Qi2 requests exposure (0->1 starts exposure)
@@ -63,11 +88,15 @@ XRAY_IOC                      = EXPERIMENT  + 'OXFORD:xray:'
 SCAN_IOC                      = EXPERIMENT + 'SCAN:'
 MOTOR_IOC                     = EXPERIMENT + 'KOHZU:'
 DET_IOC                       = EXPERIMENT + 'Qi2:'
-# Nikon Ks PV's
+# Nikon Ks PV's. Every channel used here is a scalar or a short char waveform (file
+# names), image data never passes through this driver, so all of them stay on CA.
+# pyepics already hands waveforms over as numpy arrays when numpy is installed.
 NIKON_ACQUIRE                 = PV(DET_IOC + 'cam1:Acquire', callback = True)
 NIKON_ACQUIRE_TIME_RBV        = PV(DET_IOC + 'cam1:AcquireTime_RBV', callback = True)
 NIKON_FULL_FILENAME_RBV       = PV(DET_IOC + 'TIFF1:FullFileName_RBV', callback = True)
 NIKON_FILEPATH                = PV(DET_IOC + 'TIFF1:FilePath', callback = False)
+NIKON_FILEPATH_RBV            = PV(DET_IOC + 'TIFF1:FilePath_RBV', callback = False)
+NIKON_SOFT_TRIGGER            = PV(DET_IOC + 'cam1:SoftTrigger', callback = False)
 NIKON_IMAGE_MODE              = PV(DET_IOC + 'cam1:ImageMode', callback = False)
 NIKON_TRIGGER_MODE            = PV(DET_IOC + 'cam1:NikonTriggerMode', callback = False)
 # Nikon AD statistics PV's
@@ -76,33 +105,85 @@ NIKON_STATS_SIGMA             = PV(DET_IOC + 'Stats1:Sigma_RBV', callback = Fals
 # sscan PV's
 SCAN_DETECTOR_1               = PV(SCAN_IOC + 'scan1.T1PV', callback = False)
 SCAN_ABORT                    = PV(SCAN_IOC + 'AbortScans.PROC', callback = True)
+SCAN_1_WAIT                   = PV(SCAN_IOC + 'scan1.WAIT', callback = False)
 
 SCAN_1_NPTS                   = PV(SCAN_IOC + 'scan1.NPTS')
 SCAN_2_NPTS                   = PV(SCAN_IOC + 'scan2.NPTS')  
 SCAN_3_NPTS                   = PV(SCAN_IOC + 'scan3.NPTS')
 SCAN_4_NPTS                   = PV(SCAN_IOC + 'scan4.NPTS')  
+SCAN_NPTS                     = (SCAN_1_NPTS, SCAN_2_NPTS, SCAN_3_NPTS, SCAN_4_NPTS)
 
-SCAN_1_BUSY                   = PV(SCAN_IOC + 'scan1.BUSY')
-SCAN_2_BUSY                   = PV(SCAN_IOC + 'scan2.BUSY')
-SCAN_3_BUSY                   = PV(SCAN_IOC + 'scan3.BUSY')
-SCAN_4_BUSY                   = PV(SCAN_IOC + 'scan4.BUSY')
+SCAN_1_BUSY                   = NumericPV(SCAN_IOC + 'scan1.BUSY')
+SCAN_2_BUSY                   = NumericPV(SCAN_IOC + 'scan2.BUSY')
+SCAN_3_BUSY                   = NumericPV(SCAN_IOC + 'scan3.BUSY')
+SCAN_4_BUSY                   = NumericPV(SCAN_IOC + 'scan4.BUSY')
+SCAN_BUSY                     = (SCAN_1_BUSY, SCAN_2_BUSY, SCAN_3_BUSY, SCAN_4_BUSY)
 SCAN_DIM                      = PV(SCAN_IOC + 'ScanDim.VAL')
 
 # Constant numpy arrays for setting digital outputs high or low on NI-DAQs
 LOW  = np.zeros((1,), dtype=np.uint8)
 HIGH = np.ones((1,), dtype=np.uint8)
-# while loop and time.sleep poll time 1ms
-POLL_TIME = 0.001
+# time (s) allowed between sending the Qi2 trigger and its exposing output going high
+QI2_TRIGGER_TIMEOUT = 0.5
+# time (s) on top of the acquire time sync waits for the Qi2 to become trigger ready or
+# finish exposing before the sync is aborted
+QI2_EXPOSURE_TIMEOUT = 5.0
+# DAQ input buffer (samples) for queued Qi2 edges in change detection mode
+QI2_EDGE_BUFSIZE = 1024
+# write buffer for the post-scan report files, large enough to hold a full report
+REPORT_BUFSIZE = 1 << 16
+# overall time (s) the driver waits at startup for all motor PV's to connect
+MOTOR_CONNECT_TIMEOUT = 1.0
+# time (s) allAbort waits for the motor records to complete their STOP puts
+MOTOR_STOP_TIMEOUT = 2.0
+# server.process() timeouts (s): short while CA/DAQ activity is recent, long when idle
+PROCESS_ACTIVE_TIMEOUT = 0.001
+PROCESS_IDLE_TIMEOUT = 0.05
+# time (s) after the last write, edge or scan callback that the main loop stays active
+PROCESS_ACTIVE_WINDOW = 1.0
+# Linux only: cores the CA main loop and the abort worker are pinned to, and the SCHED_FIFO
+# priority of the main loop (needs CAP_SYS_NICE, skipped with a warning otherwise). The cores
+# are set per machine with NIKONKS_MAIN_CPU / NIKONKS_ABORT_CPU, an empty value disables pinning.
+MAIN_LOOP_CPU = os.environ.get('NIKONKS_MAIN_CPU', '3')
+ABORT_WORKER_CPU = os.environ.get('NIKONKS_ABORT_CPU', '2')
+MAIN_LOOP_FIFO_PRIORITY = 50
+
+def _ts():
+    """
+    Millisecond timestamp prefix for console messages
+    """
+    t = time.time()
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))}.{int(t % 1 * 1000):03d}"
+
+def waitForConnections(pvs, timeout):
+    """
+    Waits for all pvs to connect against one shared deadline, so startup with an IOC down
+    takes timeout seconds in total rather than timeout per PV. Returns the PV's still
+    disconnected.
+    """
+    deadline = time.perf_counter() + timeout
+    for pv in pvs:
+        pv.wait_for_connection(timeout = max(deadline - time.perf_counter(), 0))
+    return [pv for pv in pvs if not pv.connected]
+
+def nanStats(values, scale = 1):
+    """
+    Returns (mean, stddev, min, max) of values ignoring nan's, or None if values is empty.
+    The list is converted to a float array once and all four reductions run on it.
+    """
+    arr = np.asarray(values, dtype=np.float64)
+    if not arr.size:
+        return None
+    if scale != 1:
+        arr *= scale
+    return np.nanmean(arr), np.nanstd(arr), np.nanmin(arr), np.nanmax(arr)
+
 # If DOC is ON (1) save motor pv's.
-MOTOR_IOC_LIST = [
-                    MOTOR_IOC + 'm1',  MOTOR_IOC + 'm2',  MOTOR_IOC + 'm3', \
-                    MOTOR_IOC + 'm4',  MOTOR_IOC + 'm5',  MOTOR_IOC + 'm6', \
-                    MOTOR_IOC + 'm7',  MOTOR_IOC + 'm8',  MOTOR_IOC + 'm9', \
-                    MOTOR_IOC + 'm10', MOTOR_IOC + 'm11', MOTOR_IOC + 'm12',\
-                    MOTOR_IOC + 'm13', MOTOR_IOC + 'm14', MOTOR_IOC + 'm15',\
-                    MOTOR_IOC + 'm16', MOTOR_IOC + 'm17', MOTOR_IOC + 'm18',\
-                    MOTOR_IOC + 'm19'
-                 ]
+MOTOR_IOC_LIST = tuple(f'{MOTOR_IOC}m{i}' for i in range(1, 20))
+# motor record fields used by saveParams and allAbort, built once at import
+MOTOR_RBV      = tuple(pvs + '.RBV'  for pvs in MOTOR_IOC_LIST)
+MOTOR_DMOV     = tuple(pvs + '.DMOV' for pvs in MOTOR_IOC_LIST)
+MOTOR_STOP     = tuple(pvs + '.STOP' for pvs in MOTOR_IOC_LIST)
 # pcas records
 prefix = EXPERIMENT + 'NikonKsSync:'
 pvdb = {
@@ -121,6 +202,8 @@ pvdb = {
     'REPORT'                    : {'type'  : 'enum',
                                    'enums' : ['OFF', 'ON'],},
     'ABORT'                     : {'asyn'  : True},
+    'DEBUG'                     : {'type'  : 'enum',
+                                   'enums' : ['OFF', 'ON'],},
     'DUTYCYCLE_RBV'             : {'prec'  : 6,
                                    'unit'  : '%'},
     'ACQUIRE_RBV'               : {'prec'  : 6,
@@ -142,19 +225,63 @@ class myDriver(Driver):
         """
         Constructor to set initial parameters polling threads, callbacks etc
         """
-        super(myDriver, self).__init__()
+        super().__init__()
+        # per-exposure debug messages, follows $(P):DEBUG
+        self.debug = False
+        # perf_counter() time of the last write, Qi2 edge or scan callback, the main loop
+        # uses it to pick the server.process() timeout
+        self.last_event_ts = time.perf_counter()
+        # write() dispatch table, records not listed here are only set
+        self._write_handlers = {
+            'TRIGGER'       : self.onTrigger,
+            'SEND_TRIGGER'  : self.onSendTrigger,
+            'REPORT'        : self.onReport,
+            'ABORT'         : self.onAbort,
+            'SYNC_MODE_RBV' : self.onSyncMode,
+            'DEBUG'         : self.onDebug,
+        }
         # set high priority for this process
         self.setProcessPriority()
+        # cores available before any thread is pinned, restored by resetThreadScheduling
+        self._cpu_mask = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None
         self.iocStats()
         self.pulseDelayAvrg = []
+        # scan and master abort sequences run in order on one worker thread, the CA
+        # callback and write() only queue them
+        self._abort_q = queue.Queue()
+        self.abort_thread = threading.Thread(target = self.abortWorker)
+        self.abort_thread.daemon = True
+        self.abort_thread.start()
         # callback PV's
         NIKON_FULL_FILENAME_RBV.add_callback(self.checkDoc)    
         SCAN_ABORT.add_callback(self.scanAbortCallback) 
+        # busy state of scan1..scan4, kept up to date by the BUSY monitors
+        self._scan_busy = [0, 0, 0, 0]
+        # already connected PV's are read from the monitor cache right away, the others get
+        # their first value with the connection's initial monitor event, so a down sscan IOC
+        # never blocks startup here
+        for dim, pv in enumerate(SCAN_BUSY):
+            pv.add_callback(self.scanBusyCallback, run_now = pv.connected, dim = dim)
         self.xrayReadyTime          = 0
+        self._xray_pvs              = {}
         self.shutter_close          = 0
         self.shutter_open           = 0
+        self.shutterTime            = 0
         self.idleTime               = 0
         self.trigger_not_ready_rbv  = 0
+        # Qi2 input line states signalled by pollQi2, sync waits on these
+        self.trigger_ready_evt      = threading.Event()
+        self.not_exposing_evt       = threading.Event()
+        # (shutterTime, idleTime) of each finished exposure, appended by pollQi2 and
+        # popped by sync. deque append/popleft are atomic, no lock on the poller side.
+        self.exposure_q             = collections.deque(maxlen = 64)
+        self.exposure_evt           = threading.Event()
+        # set on EXPOSE_OUT rising, sync clears it before each trigger
+        self.exposure_started_evt   = threading.Event()
+        # bumped by cancelSync, a sync thread started before the bump exits at its next wait
+        self._sync_gen              = 0
+        # guards the scan counters and report lists shared by sync and scanAbortSeq
+        self.scan_lock              = threading.Lock()
         self.total_npts             = 0
         self.scanStartTime          = 0
         self.elapsedScanTime        = 0
@@ -165,38 +292,57 @@ class myDriver(Driver):
         self.sigma_stats            = []
         # Create the figure object
         plt.ioff()
-        self.fig = plt.figure()
-        self.ax = self.fig.add_subplot(1, 1, 1)
+        self.fig, self.ax = plt.subplots()
+        # labels, grid and legend are set up once, each scan only replaces the line data
+        self.statsLine, = self.ax.plot([], [], 'ro-', label='Measured', linewidth=1.25)
+        self.ax.set_ylabel(r'Normalized Stdev (A.U.)', fontsize=22)
+        self.ax.set_xlabel(r'Image No.', fontsize=22)
+        self.ax.grid(which='major', axis='x', linewidth=0.75, linestyle='--', color='gray')
+        self.ax.grid(which='major', axis='y', linewidth=0.75, linestyle='--', color='gray')
+        self.ax.legend(loc='upper left')
         # Set up DO task to trigger Qi2 expose
         self.written = int32()
+        # DI read buffer for pollQi2, allocated once
+        self._poll_buf = np.zeros(2, dtype=np.uint8)
+        self.change_detect = 0
+        # digital output buffers indexed by line state (0: LOW, 1: HIGH)
+        self._dbuf = (LOW, HIGH)
         try:
             self.qi2TriggerTask = TaskHandle()
             DAQmxCreateTask("",byref(self.qi2TriggerTask))
             DAQmxCreateDOChan(self.qi2TriggerTask, NIKON_EXPOSE, "", DAQmx_Val_ChanForAllLines)
             DAQmxStartTask(self.qi2TriggerTask)     
             # Set up polling for the 2 Qi2 Inputs
-            self.qi2PollTask = TaskHandle()
-            DAQmxCreateTask("",byref(self.qi2PollTask))
-            DAQmxCreateDIChan(self.qi2PollTask, NIKON_INPUTS , "", DAQmx_Val_ChanForAllLines)
-            DAQmxStartTask(self.qi2PollTask)
+            self.qi2PollTask = self.createQi2PollTask(change_detect = True)
             # Start the Qi2 polling thread
             self.xid = threading.Thread(target=self.pollQi2,args=())
             self.xid.start()
             self.daq_init_flag = 1
         except:
             self.daq_init_flag = 0
-            print str(datetime.datetime.now())[:-3], "In function: " + inspect.stack()[0][3] + \
-                  ", Failed to create DAQ task. Check to see if DAQ is connected"
+            log.error("In function: " + inspect.stack()[0][3] + \
+                      ", Failed to create DAQ task. Check to see if DAQ is connected")
             pass
-        print self.daq_init_flag
+        log.debug('daq_init_flag: %s', self.daq_init_flag)
+        # Connect the motor readback PV's once, saveParams reads them from the monitor cache
+        self._motor_rbv_pvs = [NumericPV(pvs, auto_monitor = True) for pvs in MOTOR_RBV]
+        # (DMOV, STOP) PV pairs for allAbort, DMOV is monitored so aborts read the local cache
+        self._motor_pvs = [(NumericPV(dmov, auto_monitor = True), PV(stop, auto_monitor = False))
+                           for dmov, stop in zip(MOTOR_DMOV, MOTOR_STOP)]
+        # all channels search in parallel, then one overall wait for them
+        motor_pvs = self._motor_rbv_pvs + [pv for pair in self._motor_pvs for pv in pair]
+        disconnected = waitForConnections(motor_pvs, MOTOR_CONNECT_TIMEOUT)
+        if disconnected:
+            log.warning("In function: " + inspect.stack()[0][3] + \
+                        f", {len(disconnected)} motor PV's not connected")
         # Set scan detector PV to NikonSync hard trigger PV on init.
         SCAN_DETECTOR_1.put(EXPERIMENT + 'NikonKsSync:TRIGGER')
         # handle autosave related stuff
         epicsApps.buildRequestFiles(prefix, pvdb.keys(), os.getcwd())
         epicsApps.makeAutosaveFiles()
-        print '############################################################################'
-        print '## ADNIKONKS PCAS IOC Online $Date:' + str(datetime.datetime.now())[:-3]
-        print '############################################################################'
+        print('############################################################################')
+        print(f'## ADNIKONKS PCAS IOC Online $Date:{_ts()}')
+        print('############################################################################')
 
     def setProcessPriority(self):
         """
@@ -211,16 +357,52 @@ class myDriver(Driver):
         p = psutil.Process(os.getpid())
         if isWindows:
             try:
-                p.set_nice(psutil.HIGH_PRIORITY_CLASS)
+                p.nice(psutil.HIGH_PRIORITY_CLASS)
             except:
-                print str(datetime.datetime.now())[:-3], "In function: " + inspect.stack()[0][3] + \
-                      ", Failed setting high priority for this process"
+                log.warning("In function: " + inspect.stack()[0][3] + \
+                            ", Failed setting high priority for this process")
         else:
             try:
                 os.nice(-10)
-            except IOError:
-                print str(datetime.datetime.now())[:-3], "In function: " + inspect.stack()[0][3] + \
-                      ", Could not set high priority"
+            except OSError:
+                log.warning("In function: " + inspect.stack()[0][3] + \
+                            ", Could not set high priority")
+
+    def setThreadScheduling(self, cpu, fifo_priority = 0):
+        """
+        Pins the calling thread to cpu (a core number as string, '' leaves it unpinned) and,
+        if fifo_priority is set, moves it to SCHED_FIFO. Linux only, a no-op on Windows.
+        Threads started afterwards inherit both settings, see resetThreadScheduling.
+        """
+        if not hasattr(os, 'sched_setaffinity'):
+            return
+        if cpu != '':
+            if cpu.isdigit() and int(cpu) in os.sched_getaffinity(0):
+                os.sched_setaffinity(0, {int(cpu)})
+            else:
+                log.warning("In function: " + inspect.stack()[0][3] + \
+                            f", CPU {cpu} not available, thread not pinned")
+        if fifo_priority:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(fifo_priority))
+            except OSError:
+                log.warning("In function: " + inspect.stack()[0][3] + \
+                            ", Could not set SCHED_FIFO scheduling")
+
+    def resetThreadScheduling(self):
+        """
+        Puts the calling thread back on SCHED_OTHER with the process' original cores. Threads
+        started from the pinned SCHED_FIFO main loop (sync) call this first so they do not
+        compete with CA dispatch on its core.
+        """
+        if self._cpu_mask is None:
+            return
+        try:
+            os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+            os.sched_setaffinity(0, self._cpu_mask)
+        except OSError:
+            log.warning("In function: " + inspect.stack()[0][3] + \
+                        ", Could not reset thread scheduling")
 
     def iocStats(self):
         """
@@ -265,139 +447,233 @@ class myDriver(Driver):
         """
         pcaspy native write method
         """
-        if reason == "XSYNC":
-           self.setParam(reason, value)
-        elif reason == 'TRIGGER' and value == 1:
+        self.last_event_ts = time.perf_counter()
+        handler = self._write_handlers.get(reason)
+        if handler is not None:
+            value = handler(value)
+        self.setParam(reason, value)
+        self.updatePVs()
+
+    def onTrigger(self, value):
+        """
+        Write handler for $(P):TRIGGER, starts the sync sequence
+        """
+        if value == 1:
+            NIKON_IMAGE_MODE.put(2)   # set image mode to continous
             if self.daq_init_flag == 1:
-                NIKON_IMAGE_MODE.put(2)   # set image mode to continous
                 NIKON_TRIGGER_MODE.put(1) # set to hard mode (this allows sending trigger through the daq)
-                NIKON_ACQUIRE.put(1)
             elif self.daq_init_flag == 0:
-                NIKON_IMAGE_MODE.put(2)   # set image mode to continous 
-                NIKON_TRIGGER_MODE.put(2) # set to soft mode 
-                NIKON_ACQUIRE.put(1)
+                NIKON_TRIGGER_MODE.put(2) # set to soft mode
+            NIKON_ACQUIRE.put(1)
             self.sync_thread = threading.Thread(target = self.sync)
             self.sync_thread.daemon = True
             self.sync_thread.start()
-        elif reason == 'SEND_TRIGGER':
-            if self.daq_init_flag == 1:
-                self.fid = threading.Thread(target = self.sendTrigger, args = (self.qi2TriggerTask, value))
-                self.fid.daemon = True
-                self.fid.start()
-        elif reason == "DOC":
-            self.setParam(reason, value)
-        elif reason == "REPORT":
-            if value == 1:
-                print str(datetime.datetime.now())[:-3], 'POST-SCAN REPORT WILL BE SAVED'
-            else:
-                print str(datetime.datetime.now())[:-3], 'POST-SCAN REPORT WILL NOT BE SAVED'
-            self.setParam(reason, value)
-        elif reason == "DUTYCYCLE_RBV":
-            self.setParam(reason, value)
-        elif reason == "IDLE_RBV":
-            self.setParam(reason, value)
-        elif reason == "ACQUIRE_RBV":
-            self.setParam(reason, value)
-        elif reason == "TRIGGER_ACQUIRE_DELAY_RBV":
-            self.setParam(reason, value)
-        elif reason == "ABORT" and value == 1:
-            self.aid = threading.Thread(target = self.allAbort)
-            self.aid.daemon = True
-            self.aid.start()
-        elif reason == "SYNC_MODE_RBV":
-            if self.daq_init_flag == 1:
-                value = 1
-            elif self.daq_init_flag == 0:
-                value = 0
-            self.setParam(reason, value)
-        self.setParam(reason, value)
-        self.updatePVs() 
+        return value
+
+    def onSendTrigger(self, value):
+        """
+        Write handler for $(P):SEND_TRIGGER, sets the Qi2 expose line through the daq
+        """
+        if self.daq_init_flag == 1:
+            # a single DAQ line write, done on the calling (sync) thread
+            self.sendTrigger(self.qi2TriggerTask, value)
+        return value
+
+    def onReport(self, value):
+        """
+        Write handler for $(P):REPORT
+        """
+        if value == 1:
+            log.info('POST-SCAN REPORT WILL BE SAVED')
+        else:
+            log.info('POST-SCAN REPORT WILL NOT BE SAVED')
+        return value
+
+    def onAbort(self, value):
+        """
+        Write handler for $(P):ABORT, starts the master abort sequence
+        """
+        if value == 1:
+            self._abort_q.put(self.allAbort)
+        return value
+
+    def onDebug(self, value):
+        """
+        Write handler for $(P):DEBUG, switches the per-exposure debug messages on or off
+        """
+        self.debug = (value == 1)
+        log.setLevel(logging.DEBUG if self.debug else logging.INFO)
+        return value
+
+    def onSyncMode(self, value):
+        """
+        Write handler for $(P):SYNC_MODE_RBV, always reflects the daq state (0: SOFT, 1: HARD)
+        """
+        if self.daq_init_flag == 1:
+            value = 1
+        elif self.daq_init_flag == 0:
+            value = 0
+        return value
+
+    def createQi2PollTask(self, change_detect):
+        """
+        Creates and starts the DI task for the 2 Qi2 inputs. With change_detect the hardware
+        only posts a sample when one of the lines changes, devices that do not support
+        change detection (e.g. usb-6501) fall back to an on-demand polled task.
+        """
+        task = TaskHandle()
+        DAQmxCreateTask("",byref(task))
+        DAQmxCreateDIChan(task, NIKON_INPUTS , "", DAQmx_Val_ChanForAllLines)
+        if change_detect:
+            # no sample is posted until the first edge, so read the current line states
+            # on demand while the task is not yet committed to change detection timing
+            DAQmxReadDigitalLines(task, 1, 1, 0, self._poll_buf, 2, None, None, None)
+            try:
+                DAQmxCfgChangeDetectionTiming(task, NIKON_INPUTS, NIKON_INPUTS, DAQmx_Val_ContSamps, 1)
+                # room for edges that arrive while pollQi2 is still handling the previous one
+                DAQmxCfgInputBuffer(task, QI2_EDGE_BUFSIZE)
+                DAQmxStartTask(task)
+            except DAQError:
+                DAQmxClearTask(task)
+                log.warning("In function: " + inspect.stack()[0][3] + \
+                            ", Change detection not supported, polling Qi2 inputs")
+                return self.createQi2PollTask(change_detect = False)
+            self.change_detect = 1
+            return task
+        DAQmxStartTask(task)
+        self.change_detect = 0
+        return task
 
     def pollQi2(self):
         """
-        Polls Nikon DS-Qi2 input lines to check for exposing and trigger ready lines
+        Polls Nikon DS-Qi2 input lines to check for exposing and trigger ready lines.
+        With change detection each read blocks in the driver until one of the lines changes.
         """
-        oldval = np.array([0,0], dtype=np.uint8)
-        DAQmxReadDigitalLines(self.qi2PollTask, 1, 1, 0,  oldval, 2, None, None, None)
+        # single read buffer reused every poll, previous line states kept as plain ints
+        buf = self._poll_buf
+        if self.change_detect == 0:
+            DAQmxReadDigitalLines(self.qi2PollTask, 1, 1, 0, buf, 2, None, None, None)
+        # with change detection buf still holds the line states read in createQi2PollTask
+        old0, old1 = int(buf[0]), int(buf[1])
+        self.setQi2Events(old0, old1)
         while True:
-            newval = np.array([0,0], dtype=np.uint8)
-            DAQmxReadDigitalLines(self.qi2PollTask, 1, 1, 0,  newval, 2, None, None, None) 
-            self.write("TRIGGER_READY_RBV", newval[0])
-            self.write("EXPOSING_RBV", newval[1])
-            self.updatePVs()
-            if newval[0] != oldval[0]:
-                if newval[0] == 1: # trigger is ready
+            try:
+                DAQmxReadDigitalLines(self.qi2PollTask, 1, 1, 0, buf, 2, None, None, None)
+            except DAQError as e:
+                if e.error == DAQmxErrorSamplesNotYetAvailable: # no edge within the 1s timeout
+                    continue
+                raise
+            # one timestamp per sample, i.e. per edge with change detection
+            now = time.perf_counter()
+            n0, n1 = int(buf[0]), int(buf[1])
+            if n0 == old0 and n1 == old1:
+                continue
+            self.setParam('TRIGGER_READY_RBV', n0)
+            self.setParam('EXPOSING_RBV', n1)
+            if n0 != old0:
+                if n0 == 1: # trigger is ready
                     self.idleTime = self.trigger_not_ready_rbv - self.shutter_close
                     self.setParam('IDLE_RBV', self.idleTime)
-                    print str(datetime.datetime.now())[:-3], 'DETECTOR END EXPOSURE'
-                    self.shutter_close = time.clock()
+                    self.shutter_close = now
                     self.shutterTime = self.shutter_close - self.shutter_open
                     self.setParam('ACQUIRE_RBV', self.shutterTime)
-                    print str(datetime.datetime.now())[:-3], 'DETECTOR ACQUIRE TIME:', \
-                    self.shutterTime,'s'
-                if newval[0] == 0: # trigger is not ready
-                    self.trigger_not_ready_rbv = time.clock()
-            if newval[1] != oldval[1]:
-                if newval[1] == 1: # acquisition started/acquiring
-                    print str(datetime.datetime.now())[:-3], 'IDLE TIME:', \
-                    self.idleTime,'s'
-                    print str(datetime.datetime.now())[:-3], 'DETECTOR START EXPOSURE'
-                    self.shutter_open = time.clock()
-                    print str(datetime.datetime.now())[:-3], 'TRIGGER_READY->ACQUIRING DELAY:', \
-                    self.shutter_open - self.trigger_not_ready_rbv,'s'
+                    self.exposure_q.append((self.shutterTime, self.idleTime))
+                    if self.debug:
+                        log.debug('DETECTOR END EXPOSURE')
+                        log.debug('DETECTOR ACQUIRE TIME: %s s', self.shutterTime)
+                if n0 == 0: # trigger is not ready
+                    self.trigger_not_ready_rbv = now
+            if n1 != old1:
+                if n1 == 1: # acquisition started/acquiring
+                    self.shutter_open = now
+                    if self.debug:
+                        log.debug('IDLE TIME: %s s', self.idleTime)
+                        log.debug('DETECTOR START EXPOSURE')
+                        log.debug('TRIGGER_READY->ACQUIRING DELAY: %s s', self.shutter_open - self.trigger_not_ready_rbv)
                     self.setParam('TRIGGER_ACQUIRE_DELAY_RBV', self.shutter_open - self.trigger_not_ready_rbv)
-                if newval[1] == 0: # acquisition ended/not acquiring
-                    self.notExposing = time.clock()
-                    print str(datetime.datetime.now())[:-3], 'NOT ACQUIRING->NEXT TRIGGER_READY DELAY:', \
-                    self.notExposing - self.shutter_close,'s'
-            oldval = newval
+                if n1 == 0: # acquisition ended/not acquiring
+                    self.notExposing = now
+                    if self.debug:
+                        log.debug('NOT ACQUIRING->NEXT TRIGGER_READY DELAY: %s s', self.notExposing - self.shutter_close)
+            # line state events first, so a sync thread woken by an edge event below never
+            # sees the previous line state
+            self.setQi2Events(n0, n1)
+            if n1 != old1 and n1 == 1:
+                self.exposure_started_evt.set()
+            if n0 != old0 and n0 == 1:
+                self.exposure_evt.set()
+            self.last_event_ts = now
+            # the only flush in the loop: every record touched above goes out in one update
             self.updatePVs()
+            old0, old1 = n0, n1
+
+    def setQi2Events(self, trigger_ready, exposing):
+        """
+        Mirrors the Qi2 TRIGGER_READY and EXPOSE_OUT line states into the events sync waits on
+        """
+        if trigger_ready == 1:
+            self.trigger_ready_evt.set()
+        else:
+            self.trigger_ready_evt.clear()
+        if exposing == 1:
+            self.not_exposing_evt.clear()
+        else:
+            self.not_exposing_evt.set()
 
     def sendTrigger(self, DAQtaskName, value):
         """
         Andrew's compact code to send trigger to Qi2. Used to be setDigiOut
         """
-        if type(value) != np.ndarray:
-            if value == 0:
-                value = LOW
-            else:
-                value = HIGH
-        self.processDAQstatus(DAQmxWriteDigitalLines(DAQtaskName,1,1,10.0,DAQmx_Val_GroupByChannel,value,self.written,None))  
+        buf = value if isinstance(value, np.ndarray) else self._dbuf[1 if value else 0]
+        self.processDAQstatus(DAQmxWriteDigitalLines(DAQtaskName,1,1,10.0,DAQmx_Val_GroupByChannel,buf,self.written,None))
 
     def processDAQstatus(self, errorcode):
         if errorcode != 0:
-            print str(datetime.now())[:-3], "NI-DAQ error! Code:", errorcode
+            log.error('NI-DAQ error! Code: %s', errorcode)
+
+    def xrayPV(self, field):
+        """
+        Returns the monitored PV for XRAY_IOC + field, created on first use and
+        kept per x-ray ioc so switching XSYNC does not reconnect channels
+        """
+        pvs = self._xray_pvs.setdefault(XRAY_IOC, {})
+        if field not in pvs:
+            pvs[field] = PV(XRAY_IOC + field, auto_monitor = True)
+        return pvs[field]
 
     def startXray(self):
         """
         Returns when the x-ray is on and outputting x-rays at set values
         """
-        if self.getParam('XSYNC') == 2: # x-ray sync is set to oxford/nova
-            if caget(XRAY_IOC + 'STATUS_RBV') == 5: # make sure x-ray is not in fault mode.
-                print str(datetime.datetime.now())[:-3], 'X-ray is in fault mode!'
+        xsync = self.getParam('XSYNC')
+        if xsync == 2: # x-ray sync is set to oxford/nova
+            status = self.xrayPV('STATUS_RBV').get()
+            firing = self.xrayPV('FIRING_RBV')
+            if status == 5: # make sure x-ray is not in fault mode.
+                log.error('X-ray is in fault mode!')
                 return
             else:
-                if caget(XRAY_IOC + 'STATUS_RBV') == 0: # xray is warming
-                    print str(datetime.datetime.now())[:-3], 'Waiting for warm up to finish!'
+                if status == 0: # xray is warming
+                    log.warning('Waiting for warm up to finish!')
                     return
-                if caget(XRAY_IOC + 'STATUS_RBV') == 1: # if xray in standby mode i.e not outputting 
+                if status == 1: # if xray in standby mode i.e not outputting 
                     # turn on x-ray -> this is output mode
-                    caput(XRAY_IOC + 'ON', '1')
+                    self.xrayPV('ON').put(1)
                     # wait for x-ray to reach set points
-                    while (caget(XRAY_IOC + 'FIRING_RBV') != 1): # this record is sampled at 10Hz in the db
+                    while (firing.get() != 1): # this record is sampled at 10Hz in the db
                         time.sleep(0.01)
-                    print str(datetime.datetime.now())[:-3], 'X-ray is outputting at set points'
-                elif caget(XRAY_IOC + 'STATUS_RBV') == 3 or caget(XRAY_IOC + 'STATUS_RBV') == 2: # if xray is pulsing or outputting
-                    caput(XRAY_IOC + 'PULSE_MODE', '0')
+                    log.debug('X-ray is outputting at set points')
+                elif status == 3 or status == 2: # if xray is pulsing or outputting
+                    self.xrayPV('PULSE_MODE').put(0)
                     # switch from pulse to output mode...
-                    while (caget(XRAY_IOC + 'FIRING_RBV') != 1):
+                    while (firing.get() != 1):
                         time.sleep(0.01)
-                    print str(datetime.datetime.now())[:-3], 'X-ray is outputting at set points'
-        elif self.getParam('XSYNC') == 1: # x-ray sync is set to sri
-            caput(XRAY_IOC + 'ON', '1') 
-            print str(datetime.datetime.now())[:-3], 'X-ray is outputting at set points'
-        elif self.getParam('XSYNC') == 0:
-            print str(datetime.datetime.now())[:-3], 'Acquiring dark image!'
+                    log.debug('X-ray is outputting at set points')
+        elif xsync == 1: # x-ray sync is set to sri
+            self.xrayPV('ON').put(1) 
+            log.debug('X-ray is outputting at set points')
+        elif xsync == 0:
+            log.debug('Acquiring dark image!')
             return
 
     def stopXray(self):
@@ -407,160 +683,248 @@ class myDriver(Driver):
         if self.getParam('XSYNC') == 0:
             return
         else:
-            caput(XRAY_IOC + 'ON', '0')
-        print str(datetime.datetime.now())[:-3], 'X-ray is off'
+            self.xrayPV('ON').put(0)
+        log.debug('X-ray is off')
 
-    def afterScan(self):
+    def takeScan(self):
+        """
+        Returns the finished scan's start time, point count and report lists and resets them
+        for the next scan. Called with scan_lock held, the report is built from the snapshot
+        after the lock is released.
+        """
+        scan = (self.scanStartTime, self.total_npts, self.shutterTimeList, self.dutyCycleList,
+                self.mean_stats, self.sigma_stats)
+        self.shutterTimeList = []
+        self.dutyCycleList = []
+        self.mean_stats = []
+        self.sigma_stats = []
+        self.scanStartTime = 0
+        self.total_cpts = 0
+        self.total_npts = 0
+        return scan
+
+    def afterScan(self, scan):
+         startTime, npts, shutterTimes, dutyCycles, meanStats, sigmaStats = scan
          self.stopXray()
          self.setParam('TRIGGER', 0)
-         self.elapsedScanTime = str(datetime.timedelta(0, time.clock() - self.scanStartTime))
+         self.elapsedScanTime = str(datetime.timedelta(seconds = time.perf_counter() - startTime))
          if (self.getParam('REPORT') == 1):
-             # the first two points don't make sense
-             try:
-                 self.dutyCycleList.pop(0)
-                 self.dutyCycleList.pop(1)
-             except:
-                 print str(datetime.datetime.now())[:-3], 'In function: ' + inspect.stack()[0][3] + \
-                       ', self.dutyCycleList is empty'
-                 pass
-             self.reportStatistics()
-             self.scanReport()
-         self.shutterTime   = []
-         self.dutyCycleList = []
-         self.fig.delaxes(self.ax)
-         self.ax = self.fig.add_subplot(1, 1, 1)
-         self.scanStartTime = 0
-         self.total_cpts = 0
+             # the first two points don't make sense, drop them (entries 0 and 1)
+             if len(dutyCycles) < 2:
+                 log.warning('In function: ' + inspect.stack()[0][3] + \
+                             ', dutyCycleList is empty')
+             del dutyCycles[:2]
+             self.reportStatistics(meanStats, sigmaStats)
+             self.scanReport(npts, shutterTimes, dutyCycles)
+         self.statsLine.set_data([], [])
         
     def sync(self):
         """
         Synchronizes the x-ray source exposure (master clock) with the detector shutter (slave)
         """
+        # started from write() on the main loop thread, drop its core and FIFO priority
+        self.resetThreadScheduling()
+        report_on = (self.getParam('REPORT') == 1)
+        gen = self._sync_gen
         # sequence for sync trigger
         if self.scanStartTime == 0:
-            self.scanStartTime = time.clock()
+            self.scanStartTime = time.perf_counter()
         self.startXray()
         if self.daq_init_flag == 1:
+            acquireTime = NIKON_ACQUIRE_TIME_RBV.get()
+            timeout = QI2_EXPOSURE_TIMEOUT + (acquireTime or 0)
             self.write('SEND_TRIGGER', 0)
             time.sleep(0.025)
             # check to see if we are ready to expose
-            while self.getParam('TRIGGER_READY_RBV') != 1:
-                time.sleep(POLL_TIME)
-            self.updatePVs()
+            if not self.syncWait(self.trigger_ready_evt, timeout, gen, 'Qi2 not trigger ready'):
+                return
+            # drop timings of exposures this sequence did not trigger
+            self.exposure_q.clear()
+            self.exposure_evt.clear()
+            self.exposure_started_evt.clear()
             self.write('SEND_TRIGGER', 1)
-            time.sleep(0.025)
-            while self.getParam('EXPOSING_RBV') == 1:
-                time.sleep(POLL_TIME)
-            self.updatePVs()
+            # continue as soon as the Qi2 reports it is exposing rather than after a fixed 25ms
+            if not self.syncWait(self.exposure_started_evt, QI2_TRIGGER_TIMEOUT, gen,
+                                 'Qi2 did not start exposing after trigger'):
+                return
+            if not self.syncWait(self.not_exposing_evt, timeout, gen, 'Qi2 exposure did not end'):
+                return
+            # the exposure is timed when the Qi2 is trigger ready again
+            if not self.syncWait(self.exposure_evt, timeout, gen, 'Qi2 not trigger ready after exposure'):
+                return
+            if not self.exposure_q:
+                log.error('In function: ' + inspect.stack()[0][3] + \
+                          ', No exposure timing recorded, sync aborted')
+                self.stopXray()
+                self.setParam('TRIGGER', 0)
+                self.updatePVs()
+                return
+            shutterTime, idleTime = self.exposure_q.popleft()
         elif self.daq_init_flag == 0:
-            print str(datetime.datetime.now())[:-3], 'DETECTOR START EXPOSURE'
-            caput(DET_IOC + 'cam1:SoftTrigger', "1")
-            time.sleep(NIKON_ACQUIRE_TIME_RBV.get())
-            print str(datetime.datetime.now())[:-3], 'DETECTOR END EXPOSURE'
+            log.debug('DETECTOR START EXPOSURE')
+            NIKON_SOFT_TRIGGER.put(1)
+            shutterTime = NIKON_ACQUIRE_TIME_RBV.get()
+            time.sleep(shutterTime)
+            log.debug('DETECTOR END EXPOSURE')
         # scan logic start
-        if SCAN_1_BUSY.get() or SCAN_2_BUSY.get() or SCAN_3_BUSY.get() or SCAN_4_BUSY.get():
-            self.total_cpts += 1
-            caput(SCAN_IOC + 'scan1.WAIT', 0)
-            if self.daq_init_flag == 1:
-                self.shutterTimeList.append(self.shutterTime)
-            elif self.daq_init_flag == 0:
-                self.shutterTimeList.append(NIKON_ACQUIRE_TIME_RBV.get())
-            if self.total_cpts > 1 and self.daq_init_flag == 1:
-                self.dutyCycleList.append(self.shutterTime/(self.idleTime + self.shutterTime))
-                self.setParam('DUTYCYCLE_RBV',100 *self.shutterTime/(self.idleTime + self.shutterTime))
+        if any(self._scan_busy):
+            SCAN_1_WAIT.put(0)
+            # CA reads are done before taking scan_lock, a scan abort only ever waits for the
+            # list and counter updates below.
             # Grab the image statistics right after qi2 is finished exposing.
-            if (self.getParam('REPORT') == 1):
-                self.mean_stats.append(NIKON_STATS_MEAN.get(as_string=False))
-                self.sigma_stats.append(NIKON_STATS_SIGMA.get(as_string=False))
-            # check if all images from scan are done. 
-            if SCAN_DIM.get() == 4:
-                self.total_npts = SCAN_1_NPTS.get()*SCAN_2_NPTS.get()*SCAN_3_NPTS.get()*SCAN_4_NPTS.get()
-            elif SCAN_DIM.get() == 3:
-                self.total_npts = SCAN_1_NPTS.get()*SCAN_2_NPTS.get()*SCAN_3_NPTS.get()
-            elif SCAN_DIM.get() == 2:
-                self.total_npts = SCAN_1_NPTS.get()*SCAN_2_NPTS.get()
-            elif SCAN_DIM.get() == 1:
-                self.total_npts = SCAN_1_NPTS.get()
-            if (self.total_cpts >= self.total_npts):
-                self.afterScan()
-            self.updatePVs()
+            if report_on:
+                mean = NIKON_STATS_MEAN.get(as_string=False)
+                sigma = NIKON_STATS_SIGMA.get(as_string=False)
+            # The number of points is fixed for the whole scan, so it is only read on the
+            # first image.
+            npts = self.total_npts or self.scanPoints()
+            if npts is None:
+                # sscan PV's unreadable, retried on the next image
+                log.error('In function: ' + inspect.stack()[0][3] + \
+                          ', Could not read scan dimension/points, scan completion not checked')
+                self.stopXray()
+            scan = None
+            with self.scan_lock:
+                # cancelled while reading the stats/points above: scanAbortSeq has reset the
+                # counters, this point belongs to the aborted scan and is dropped
+                if gen != self._sync_gen:
+                    log.debug('Sync cancelled by abort, scan point dropped')
+                    return
+                self.total_cpts += 1
+                self.shutterTimeList.append(shutterTime)
+                if self.total_cpts > 1 and self.daq_init_flag == 1:
+                    cycleTime = idleTime + shutterTime
+                    # no edges seen yet, skip instead of stopping the sync thread
+                    if cycleTime != 0:
+                        dutyCycle = shutterTime/cycleTime
+                        self.dutyCycleList.append(dutyCycle)
+                        self.setParam('DUTYCYCLE_RBV', 100.0*dutyCycle)
+                if report_on:
+                    self.mean_stats.append(mean)
+                    self.sigma_stats.append(sigma)
+                # check if all images from scan are done
+                if npts is not None:
+                    self.total_npts = npts
+                    if (self.total_cpts >= self.total_npts):
+                        scan = self.takeScan()
+            # the report (files, plot) is written outside the lock from the snapshot, not for
+            # a scan aborted in the meantime
+            if scan is not None and gen == self._sync_gen:
+                self.afterScan(scan)
         # single exposure
         else:
             self.stopXray()
             self.setParam('TRIGGER', 0)
+            self.scanStartTime = 0
         self.updatePVs()
 
-    def scanReport(self):
+    def syncWait(self, evt, timeout, gen, what):
+        """
+        Waits up to timeout for one of the Qi2 events in sync. Returns True if it was set and
+        the sync was not cancelled meanwhile. On a timeout the sync is aborted: x-ray off and
+        $(P):TRIGGER reset. A cancelled sync just returns False, the abort sequence already
+        cleaned up.
+        """
+        ok = evt.wait(timeout)
+        if gen != self._sync_gen:
+            log.debug('Sync cancelled by abort')
+            return False
+        if not ok:
+            log.error('In function: sync, ' + what + ', sync aborted')
+            self.stopXray()
+            self.setParam('TRIGGER', 0)
+            self.updatePVs()
+        return ok
+
+    def cancelSync(self):
+        """
+        Makes a sync thread blocked on a Qi2 event exit. The events are set to wake it, then
+        the line state events are restored from the last Qi2 readbacks.
+        """
+        self._sync_gen += 1
+        for evt in (self.trigger_ready_evt, self.not_exposing_evt, self.exposure_started_evt,
+                    self.exposure_evt):
+            evt.set()
+        self.setQi2Events(self.getParam('TRIGGER_READY_RBV'), self.getParam('EXPOSING_RBV'))
+
+    def scanPoints(self):
+        """
+        Returns the total number of points of the running scan (product of the NPTS of the
+        active dimensions), or None if ScanDim or one of the NPTS PV's can not be read.
+        """
+        dim = SCAN_DIM.get()
+        if dim is None:
+            return None
+        total = 1
+        for npts in SCAN_NPTS[:int(dim)]:
+            n = npts.get()
+            if n is None:
+                return None
+            total *= n
+        return total
+
+    def scanReport(self, npts, shutterTimes, dutyCycles):
         """
         Writes sscan info to text file
         """
-        with open(NIKON_FILEPATH.get(as_string = True) + os.sep + 'scanReport_' + time.strftime("%Y%m%d-%H%M%S") + '.txt', 'w+') as f:
-            f.write('# ' + EXPERIMENT.split(':')[0] + ' Scan Report auto-generated on ' + str(datetime.datetime.now()) + '\n')
-            f.write('No. Images in Scan: ' + str(self.total_npts) + '\n')
-            f.write('Total Scan time: (HH:MM:SS) ' + self.elapsedScanTime + '\n')
-            if self.daq_init_flag == 1:
-                f.write('Camera Acquire time per image during scan: ' + str(np.nanmean(self.shutterTime)) +  \
-                        ' +/- ' +  str(np.nanstd(self.shutterTime)) + ' s/image ' + 'Min:' + \
-                        str(np.nanmin(self.shutterTime)) + ' s/image ' + 'Max: ' + str(np.nanmax(self.shutterTime)) + ' s/image\n')
-                f.write('Camera Duty Cyle during scan: ' + str(100*np.nanmean(self.dutyCycleList)) +  \
-                        ' +/- ' +  str(100*np.nanstd(self.dutyCycleList)) + ' % ' + 'Min:' + \
-                        str(100*np.nanmin(self.dutyCycleList)) + ' % ' + 'Max: ' + str(100*np.nanmax(self.dutyCycleList)) + ' %\n')
-            if self.getParam('XSYNC') != 0:
-                f.write('Accumulated X-ray Exposure time during scan: ' + str(caget(XRAY_IOC + 'MS_RBV', as_string=False)/60000.) + str(' mins\n'))
-                f.write('Accumulated X-ray Exposure mAs during scan: ' +  caget(XRAY_IOC + 'MAS_RBV', as_string=True) + str(' mAs\n'))
+        lines = []
+        lines.append(f"# {EXPERIMENT.split(':')[0]} Scan Report auto-generated on {datetime.datetime.now()}\n")
+        lines.append(f'No. Images in Scan: {npts}\n')
+        lines.append(f'Total Scan time: (HH:MM:SS) {self.elapsedScanTime}\n')
+        if self.daq_init_flag == 1:
+            st = nanStats(shutterTimes)
+            dc = nanStats(dutyCycles, scale = 100)
+            if st is not None:
+                lines.append(f'Camera Acquire time per image during scan: {st[0]} +/- {st[1]} s/image '
+                             f'Min:{st[2]} s/image Max: {st[3]} s/image\n')
+            if dc is not None:
+                lines.append(f'Camera Duty Cyle during scan: {dc[0]} +/- {dc[1]} % '
+                             f'Min:{dc[2]} % Max: {dc[3]} %\n')
+        if self.getParam('XSYNC') != 0:
+            lines.append(f"Accumulated X-ray Exposure time during scan: {self.xrayPV('MS_RBV').get(as_string=False)/60000.} mins\n")
+            lines.append(f"Accumulated X-ray Exposure mAs during scan: {self.xrayPV('MAS_RBV').get(as_string=True)} mAs\n")
+        # CA reads are done before the file is opened, the report goes out in one write
+        with open(NIKON_FILEPATH.get(as_string = True) + os.sep + 'scanReport_' + time.strftime("%Y%m%d-%H%M%S") + '.txt', 'w+', REPORT_BUFSIZE) as f:
+            f.write(''.join(lines))
     
-    def reportStatistics(self):
+    def reportStatistics(self, meanStats, sigmaStats):
         """
         Writes image statistics info to text file, useful for alignment purposes during scan
         """
-        norm_sigma = []
-        with open(NIKON_FILEPATH.get(as_string = True) + os.sep + 'imageStatistics_' + time.strftime("%Y%m%d-%H%M%S") + '.txt', 'w+') as f:
-            f.write('# VPFI Image Statistics auto-generated on ' + str(datetime.datetime.now()) + '\n')
-            f.write('Mean' + '\t' + 'Sigma' + '\t' + 'Normalized Sigma' + '\n')
-            try:
-                for m, s in zip(self.mean_stats, self.sigma_stats):
-                    norm_sigma.append(s/m)
-                    f.write(str(m) + '\t' + str(s) + '\t' + str(s/m) + '\n')
-            except:
-                pass
-        self.ax.plot(norm_sigma, 'ro-', label='Measured', linewidth=1.25)
-        self.ax.set_ylabel(r'Normalized Stdev (A.U.)', fontsize=22)
-        self.ax.set_xlabel(r'Image No.', fontsize=22)
-        self.ax.grid(which='major', axis='x', linewidth=0.75, linestyle='--', color='gray')
-        self.ax.grid(which='major', axis='y', linewidth=0.75, linestyle='--', color='gray')
-        self.ax.legend(loc='upper left')
+        mean = np.asarray(meanStats, dtype=np.float64)
+        sigma = np.asarray(sigmaStats, dtype=np.float64)
+        # missing stats come through as nan, zero means as inf
+        with np.errstate(divide='ignore', invalid='ignore'):
+            norm_sigma = sigma/mean
+        with open(NIKON_FILEPATH.get(as_string = True) + os.sep + 'imageStatistics_' + time.strftime("%Y%m%d-%H%M%S") + '.txt', 'w+', REPORT_BUFSIZE) as f:
+            # title and column names go out as the savetxt header, rows land in the file buffer
+            np.savetxt(f, np.column_stack((mean, sigma, norm_sigma)), fmt='%.12g', delimiter='\t',
+                       header=f'# VPFI Image Statistics auto-generated on {datetime.datetime.now()}\nMean\tSigma\tNormalized Sigma',
+                       comments='')
+        self.statsLine.set_data(np.arange(norm_sigma.size), norm_sigma)
+        self.ax.relim()
+        self.ax.autoscale_view()
         self.fig.savefig(NIKON_FILEPATH.get(as_string = True) + os.sep + 'imageStatistics_' + \
                          time.strftime("%Y%m%d-%H%M%S") + ".jpg", bbox_inches='tight', dpi=80)
-        plt.close(self.fig)
-        f.close()
-        self.mean_stats = []
-        self.sigma_stats = []
-        norm_sigma = []
-        print str(datetime.datetime.now())[:-3], 'Report log Successful.'
+        log.info('Report log Successful.')
     
     def saveParams(self):
         """
         Daemon thread that saves a text file with the same name as 
         the image name. The file contains motor position readback values.
         """
-        filePath = caget(DET_IOC + 'TIFF1:FilePath_RBV', as_string=True)
-        fullFileName = caget(DET_IOC + 'TIFF1:FullFileName_RBV', as_string=True)
+        filePath = NIKON_FILEPATH_RBV.get(as_string=True)
+        fullFileName = NIKON_FULL_FILENAME_RBV.get(as_string=True)
         if fullFileName == '':
             return 
         else:
-            self.val = []
-            for pvs in MOTOR_IOC_LIST:
-                try:
-                    self.val.append(caget(pvs + '.RBV'))
-                except:
-                    pass
+            # disconnected motors are written as None rather than waiting on a reconnect
+            self.val = [pv.value if pv.connected else None for pv in self._motor_rbv_pvs]
             fileName = (fullFileName.split('\\')[-1]).split('.')[0]        
-            f = open(filePath + fileName + '.txt', 'w')
-            # Save relevant PVs in PV_LIST
-            for i, j in zip(MOTOR_IOC_LIST, self.val):
-                f.write(i + " - " + str(j) + '\n')
-            f.close()
-            print str(datetime.datetime.now())[:-3], 'Document successful.'
+            # Save relevant PVs in PV_LIST, one line per motor in a single write
+            with open(filePath + fileName + '.txt', 'w') as f:
+                f.write(''.join(f'{i} - {j}\n' for i, j in zip(MOTOR_IOC_LIST, self.val)))
+            log.debug('Document successful.')
             self.save_params_thread = None
 
     def checkDoc(self, **kw):
@@ -575,57 +939,139 @@ class myDriver(Driver):
         else:
             return
 
+    def scanBusyCallback(self, value = None, dim = 0, **kw):
+        """
+        Callback function for the sscan BUSY PV's, records whether scan dimension dim is busy
+        so sync() can tell scans from single exposures without a CA get.
+        """
+        self._scan_busy[dim] = value
+        self.last_event_ts = time.perf_counter()
+
     def scanAbortCallback(self, **kw):
         """
-        Start the scan abort thread
+        Queue the scan abort sequence for the abort worker
+        """
+        self.last_event_ts = time.perf_counter()
+        self._abort_q.put(self.scanAbortSeq)
+
+    def abortWorker(self):
         """
-        self.scan_abort_thread = threading.Thread(target = self.scanAbortSeq, args=())
-        self.scan_abort_thread.daemon = True
-        self.scan_abort_thread.start()
+        Runs queued abort sequences one at a time, off the CA callback and pcas threads
+        """
+        # keep abort I/O off the core the CA main loop runs on
+        self.setThreadScheduling(ABORT_WORKER_CPU)
+        while True:
+            job = self._abort_q.get()
+            try:
+                job()
+            except Exception:
+                log.exception('In function: %s, abort sequence failed', job.__name__)
     
     def scanAbortSeq(self):
         """
         Start the scan abort sequence
         """
-        print str(datetime.datetime.now())[:-3], 'START SCAN ABORT SEQUENCE!'
+        log.info('START SCAN ABORT SEQUENCE!')
         self.stopXray()
+        self.cancelSync()
         self.setParam('TRIGGER', 0)
-        if self.getParam('REPORT') == 1:
-             self.mean_stats         = []
-             self.sigma_stats        = []
-             self.shutterTime        = []
-             self.dutyCycleList      = []
-             self.fig.delaxes(self.ax)
-             self.ax = self.fig.add_subplot(1, 1, 1)
-        print str(datetime.datetime.now())[:-3], 'END SCAN ABORT SEQUENCE!'
-        self.scan_abort_thread = None
+        with self.scan_lock:
+            self.scanStartTime = 0
+            self.total_cpts = 0
+            self.total_npts = 0
+            if self.getParam('REPORT') == 1:
+                 self.mean_stats         = []
+                 self.sigma_stats        = []
+                 self.shutterTimeList    = []
+                 self.dutyCycleList      = []
+                 self.statsLine.set_data([], [])
+        log.info('END SCAN ABORT SEQUENCE!')
     
     def allAbort(self):
         """
         Master all abort sequence. Similar to scan abort callback function, but in addition
         stops any moving motors and disables camera acquisition
         """
-        print str(datetime.datetime.now())[:-3], 'START MASTER ABORT SEQUENCE!'
-        # stop x-ray, motor, disable camera acquisition and clear report lists.
+        log.info('START MASTER ABORT SEQUENCE!')
+        # x-ray off first. The scan abort queued by SCAN_ABORT only runs on this worker after
+        # allAbort returns, so it must not be the one to stop the beam.
+        self.stopXray()
+        # stop motor, disable camera acquisition and clear report lists.
         SCAN_ABORT.put(1)
-        for pvs in MOTOR_IOC_LIST:
-            if caget(pvs + '.DMOV') == 0:
-                caput(pvs + '.STOP', 1)
+        # DMOV values come from the monitors set up in __init__, so checking which motors
+        # move costs no CA reads at all (cheaper than a batched caget_many of every DMOV).
+        moving = [stop for dmov, stop in self._motor_pvs if dmov.value == 0]
+        # motors whose STOP put has not completed yet, emptied by onStopComplete
+        pending = set(stop.pvname for stop in moving)
+        done = threading.Event()
+        # fire the STOP puts without waiting for each ack, onStopComplete counts the
+        # completions so all motors stop in parallel. pyepics' put() already polls (and so
+        # flushes) the CA send queue itself, no separate flush is needed and deferring puts
+        # to one flush per main loop tick would only delay them.
+        for stop in moving:
+            stop.put(1, wait = False, callback = self.onStopComplete,
+                     callback_data = (stop.pvname, pending, done))
         NIKON_ACQUIRE.put(0)
-        print str(datetime.datetime.now())[:-3], 'END MASTER ABORT SEQUENCE!'
-        self.aid = None
+        if moving:
+            # completions are checked on their own thread, the abort worker stays free for
+            # the scan abort queued by SCAN_ABORT
+            watcher = threading.Thread(target = self.checkMotorStops, args = (pending, done))
+            watcher.daemon = True
+            watcher.start()
+        log.info('END MASTER ABORT SEQUENCE!')
+
+    def onStopComplete(self, data = None, **kw):
+        """
+        Put completion callback for the motor STOP PV's, sets the abort's done event after the
+        last one
+        """
+        pvname, pending, done = data
+        pending.discard(pvname)
+        if not pending:
+            done.set()
+
+    def checkMotorStops(self, pending, done):
+        """
+        Warns about motors whose STOP put did not complete within MOTOR_STOP_TIMEOUT
+        """
+        if not done.wait(MOTOR_STOP_TIMEOUT):
+            log.warning('In function: allAbort, STOP not completed for: %s',
+                        ', '.join(sorted(pending)))
 
 if __name__ == '__main__':
+    logging.basicConfig(stream = sys.stdout, format = '%(asctime)s.%(msecs)03d %(message)s',
+                        datefmt = '%Y-%m-%d %H:%M:%S')
     server = SimpleServer()
     server.createPV(prefix, pvdb)
     # create the driver object
     driver = myDriver()
-    # Process CA transactions
+    # Process CA transactions. process() blocks on the server sockets until there is CA
+    # traffic or the timeout expires, DAQ polling and sync run on their own threads.
+    # Monitors posted by updatePVs() from those threads go out on the next process() call,
+    # so the timeout is kept short while there is recent activity and long when idle.
+    # pcaspy's SWIG wrapper is built with thread support and releases the GIL while
+    # process() waits, so the DAQ, sync, abort and CA callback threads run meanwhile.
+    # While a scan is busy process() is woken on a fixed PROCESS_ACTIVE_TIMEOUT grid instead
+    # of relative timeouts, a late loop drops the missed periods rather than catching up.
+    # pin the main loop to its own core at real-time priority. The DAQ poll, abort and CA
+    # threads already run and keep their scheduling, sync threads started from write()
+    # reset theirs to SCHED_OTHER on all cores when they start.
+    driver.setThreadScheduling(MAIN_LOOP_CPU, MAIN_LOOP_FIFO_PRIORITY)
+    t_next = time.perf_counter()
     while True:
         try:
-            server.process(0.0001)
+            now = time.perf_counter()
+            if any(driver._scan_busy):
+                # the deadline only moves on once it has passed, process() returning early
+                # on CA traffic must not push it further out
+                if now >= t_next:
+                    t_next += PROCESS_ACTIVE_TIMEOUT
+                    if t_next <= now:
+                        t_next = now + PROCESS_ACTIVE_TIMEOUT
+                server.process(t_next - now)
+            elif now - driver.last_event_ts < PROCESS_ACTIVE_WINDOW:
+                server.process(PROCESS_ACTIVE_TIMEOUT)
+            else:
+                server.process(PROCESS_IDLE_TIMEOUT)
         except KeyboardInterrupt:
-            try:
-                sys.exit(0)
-            except SystemExit:
-                os._exit(0)
+            os._exit(0)